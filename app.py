@@ -1,12 +1,31 @@
 import os
+
+# IMPORTANT: Monkey patching must happen first, so the async worker is picked before
+# anything else is imported. SOCKETIO_ASYNC_MODE=gevent needs gevent and gevent-websocket
+# installed, and gunicorn run with
+#   -k geventwebsocket.gunicorn.workers.GeventWebSocketWorker -w 1
+# The default eventlet mode runs with -k eventlet -w 1.
+ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'eventlet')
+if ASYNC_MODE not in ('eventlet', 'gevent'):
+    raise RuntimeError(f"SOCKETIO_ASYNC_MODE must be 'eventlet' or 'gevent', not {ASYNC_MODE!r}")
+if ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+else:
+    import eventlet
+    eventlet.monkey_patch()
+
+import gzip
+import hashlib
 import logging
 import sys
-from flask import Flask, request, session, redirect, render_template_string
-from flask_socketio import SocketIO, emit
-import eventlet
-
-# IMPORTANT: This must be called first.
-eventlet.monkey_patch()
+import time
+from collections import deque
+from functools import partial, wraps
+from flask import Flask, Response, g, request, session, redirect
+from flask_socketio import SocketIO, emit, join_room
+import brotli
+import orjson
 
 # --- Configuration ---
 # Set these as Environment Variables on Render.com for security
@@ -14,20 +33,151 @@ eventlet.monkey_patch()
 FLASK_SECRET_KEY = os.environ.get('FLASK_SECRET_KEY', 'a-very-strong-default-secret-key')
 REMOTE_PASSWORD = os.environ.get('REMOTE_PASSWORD', 'remote123')
 CLIENT_SECRET_KEY = os.environ.get('CLIENT_SECRET_KEY', 'a-secret-key-for-the-client-pc')
+# Frames are relayed as raw encoded image bytes; a full-screen keyframe can exceed
+# Engine.IO's 1 MB default.
+MAX_FRAME_BYTES = int(os.environ.get('MAX_FRAME_BYTES', 10 * 1024 * 1024))
+# Optional Socket.IO message queue (e.g. redis://...) so emits to a sid reach it from any process.
+# Opt-in only: a linked Redis on Render sets REDIS_URL, which must not switch this on by itself.
+# The broker's own emits all target sids pinned to this worker, so they skip the queue; that
+# also keeps each sid's events in order (a queued status can't be overtaken by a direct frame).
+# The queue is for emits from other processes.
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+# Most mouse moves forwarded to the client PC per second, per controller. Raise to match
+# high-refresh viewers (e.g. 120); the browser already sends at most one per animation frame.
+MOUSE_MOVE_HZ = float(os.environ.get('MOUSE_MOVE_HZ', 60))
+# STUN/TURN URLs (comma-separated) for the optional WebRTC input channel. The channel is off
+# unless this is set, so by default no browser contacts anything but the broker.
+RTC_ICE_SERVERS = [url for url in os.environ.get('RTC_ICE_SERVERS', '').split(',') if url]
+# Per-connection chatter logs at DEBUG; set LOG_LEVEL=WARNING in production to keep only problems.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
 
 # --- Logging Setup ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+# Keep library chatter off the event loop; our own messages use lazy %-formatting.
+for noisy in ('flask_socketio', 'socketio', 'engineio'):
+    logging.getLogger(noisy).setLevel(logging.WARNING)
 
 # --- Flask App & SocketIO Setup ---
 app = Flask(__name__)
 app.config['SECRET_KEY'] = FLASK_SECRET_KEY
-socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins="*", ping_timeout=60, ping_interval=25)
+class OrjsonModule:
+    """Drop-in json module that hands Socket.IO/Engine.IO packet encoding to orjson."""
+    @staticmethod
+    def dumps(obj, **kwargs):
+        # orjson output is always compact, so the separators= argument is already satisfied.
+        return orjson.dumps(obj).decode()
+
+    loads = orjson.loads
+
+socketio = SocketIO(app, async_mode=ASYNC_MODE, cors_allowed_origins="*", ping_timeout=60, ping_interval=25,
+                    max_http_buffer_size=MAX_FRAME_BYTES, message_queue=SOCKETIO_MESSAGE_QUEUE,
+                    json=OrjsonModule)
+
+class NoWebSocketDeflate:
+    """WSGI middleware that keeps eventlet from negotiating permessage-deflate.
+
+    Once negotiated, eventlet deflates every outgoing message. Nearly all of our
+    websocket bytes are encoded images (AVIF, WebP or JPEG), which are already
+    compressed, so deflate only burns CPU on the relay and in the browser.
+    """
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        environ.pop('HTTP_SEC_WEBSOCKET_EXTENSIONS', None)
+        return self.wsgi_app(environ, start_response)
+
+# Wraps the Socket.IO middleware that SocketIO(app) installed above.
+app.wsgi_app = NoWebSocketDeflate(app.wsgi_app)
 
 # --- Global State ---
 # In a real multi-user system, you'd use a dictionary. For a single client, this is fine.
+# This state is per process: with a message queue, emits cross processes but the client PC
+# and its controllers must still be routed (sticky) to the same worker.
 active_client_sid = None
-active_controller_sids = set()
+active_controllers = {}  # controller sid -> Controller
+# Every registered controller also joins this room, so broadcasts go out as one emit.
+# Frames stay per-controller, since each one is paced by that controller's own acks.
+CONTROLLERS_ROOM = 'controllers'
+# client_status only ever carries one of two payloads, so both are built once and
+# client_status_payload points at whichever applies. Treat them as read-only.
+STATUS_CONNECTED = {'status': 'connected'}
+STATUS_DISCONNECTED = {'status': 'disconnected'}
+client_status_payload = STATUS_DISCONNECTED
+# mouse_move throttle: at most one move per interval per controller, latest position wins
+MOUSE_MOVE_INTERVAL = 1 / MOUSE_MOVE_HZ
+# Frame delivery: one unacked frame per controller. Frames arriving meanwhile queue in
+# its backlog. A keyframe replaces the queue. Patches can't be skipped, so a controller
+# whose queue overflows drops it and is resynced with a keyframe once it catches up.
+MAX_FRAME_BACKLOG = 8
+# A frame still unacked after FRAME_ACK_TIMEOUT is written off as lost (ack dropped, page
+# wedged) and the controller resynced with a keyframe, so it can never stall for good.
+FRAME_ACK_TIMEOUT = 10.0
+frame_watchdog_running = False
+# Upstream flow control: once any controller has FRAME_CREDIT frames queued, the client PC
+# is sent hold_frames, and request_frame when every controller is back under it. The
+# slowest viewer paces capture instead of filling backlogs that would only be dropped.
+# A controller whose in-flight frame is overdue stops counting, so it falls behind and goes
+# stale instead of holding everyone. Overdue is relative to its own recent delivery time
+# (FRAME_ACK_DEADLINE_FACTOR times its average send-to-ack time, at least FRAME_ACK_DEADLINE),
+# so a link that is slow but steady keeps pacing the stream rather than being cut off.
+FRAME_CREDIT = 2
+FRAME_ACK_DEADLINE = 1.0
+FRAME_ACK_DEADLINE_FACTOR = 4
+frames_held = False
+# One keyframe is fanned out to every controller, so concurrent requests for one (joins,
+# resyncs) share a single request_initial_frame. Re-ask only if it goes unanswered this long.
+KEYFRAME_REQUEST_TIMEOUT = 2.0
+keyframe_requested_at = None  # monotonic time of the outstanding request, if any
+# Latest initial_frame payload, shown to a joining controller straight away. Only one is
+# kept, and it is dropped with the client PC. The screen_updates relayed since then are
+# kept too, so while the keyframe is younger than KEYFRAME_CACHE_TTL a joiner gets
+# keyframe + updates and the client PC is not asked to re-encode a full frame. More than
+# KEYFRAME_REPLAY_LIMIT updates (None) means the cache can't be replayed. The limit leaves
+# the joiner's backlog room for the frames the client PC sends until a hold reaches it.
+KEYFRAME_CACHE_TTL = 5.0
+KEYFRAME_REPLAY_LIMIT = MAX_FRAME_BACKLOG - FRAME_CREDIT - 1
+last_keyframe = None
+last_keyframe_at = 0.0  # monotonic time last_keyframe arrived
+updates_since_keyframe = []
+# Hash of the last relayed packed screen_update. Re-applying an identical patch set right
+# after itself repaints the same pixels, so such repeats are dropped. Reset by keyframes.
+last_update_hash = None
+# Stream image format, most compact first. Controllers report what they decode when they
+# register, and the client PC is sent capabilities_update with the best format all of them
+# share. JPEG is the fallback every browser decodes.
+STREAM_FORMATS = ('avif', 'webp', 'jpeg')
+stream_format = 'jpeg'
+# Encoder quality follows the slowest controller's round-trip time: on a slow link transfer
+# time dominates, so smaller frames beat sharper ones. (max RTT ms, quality) tiers, then a floor.
+QUALITY_TIERS = ((50, 90), (200, 75))
+MIN_QUALITY = 60
+# Moving up a tier needs the RTT this far under its limit, so jitter around a boundary
+# doesn't flip the encoder (and bust the keyframe cache) on every probe.
+QUALITY_HYSTERESIS_MS = 15
+stream_quality = QUALITY_TIERS[0][1]
+# Sids whose login cookie was valid at the Socket.IO handshake; checked instead of the session.
+authenticated_sids = set()
+
+class Controller:
+    """Relay state for one registered controller (browser) socket."""
+    __slots__ = ('sid', 'formats', 'rtt', 'last_move_ts', 'pending_move', 'frame_backlog', 'frame_in_flight',
+                 'frame_sent_at', 'frame_seq', 'ack_time', 'stale')
+
+    def __init__(self, sid, formats=None):
+        self.sid = sid
+        # image formats the browser reported it can decode (JPEG is always assumed)
+        self.formats = frozenset(f for f in formats if isinstance(f, str)) if isinstance(formats, list) else frozenset()
+        self.rtt = 0.0                 # last round-trip time the browser measured, in ms
+        self.last_move_ts = 0.0        # monotonic time of the last forwarded mouse_move
+        self.pending_move = None       # newest mouse_move held back by the throttle
+        self.frame_backlog = deque()   # (event_name, data) pairs awaiting send
+        self.frame_in_flight = False   # a frame has been sent but not yet acked
+        self.frame_sent_at = 0.0       # monotonic time the in-flight frame was sent
+        self.frame_seq = 0             # bumped per send; acks for older sends are ignored
+        self.ack_time = 0.0            # moving average of send-to-ack time, in seconds
+        self.stale = False             # patches were dropped; waiting for a keyframe
 
 # --- HTML Templates ---
 LOGIN_HTML = """
@@ -43,7 +193,7 @@ CONTROL_HTML = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
     <title>Remote Control</title>
-    <script src="https://cdn.socket.io/4.7.2/socket.io.min.js"></script>
+    <link rel="preload" href="{{ socketio_js }}" as="script">
     <style>
         body, html { margin: 0; padding: 0; background-color: #000; overflow: hidden; font-family: sans-serif; }
         #screenCanvas { display: block; width: 100vw; height: 100vh; object-fit: contain; cursor: crosshair; }
@@ -57,13 +207,20 @@ CONTROL_HTML = """
     <div id="status"><span id="statusDot" class="dot waiting"></span><span id="statusText">Waiting for client PC...</span></div>
     <canvas id="screenCanvas"></canvas>
 
+    <!-- Loaded here rather than in <head> so it doesn't block the first paint; the preload above starts the fetch early. -->
+    <script src="{{ socketio_js }}"></script>
     <script>
         const socket = io({transports: ['websocket']});
         const canvas = document.getElementById('screenCanvas');
-        const ctx = canvas.getContext('2d', { alpha: false }); // Perf optimization
+        // Opaque, low-latency canvas: no alpha blending, and desynchronized skips the compositor queue.
+        const ctx = canvas.getContext('2d', { alpha: false, desynchronized: true });
         const statusText = document.getElementById('statusText');
         const statusDot = document.getElementById('statusDot');
         let nativeWidth = 0, nativeHeight = 0;
+        // The canvas is sized to the viewport, so its rect only changes on resize. Caching it
+        // keeps the per-move path from forcing a layout read.
+        let canvasRect = null;
+        window.addEventListener('resize', () => { canvasRect = null; });
 
         function updateStatus(state, text) {
             statusDot.className = `dot ${state}`;
@@ -73,71 +230,302 @@ CONTROL_HTML = """
         socket.on('connect', () => {
             console.log('Connected to server!');
             updateStatus('waiting', 'Authenticating...');
-            socket.emit('register_controller');
+            formatsReady.then(formats => socket.emit('register_controller', { formats }));
         });
         
-        socket.on('disconnect', () => updateStatus('disconnected', 'Server disconnected!'));
+        socket.on('disconnect', () => {
+            updateStatus('disconnected', 'Server disconnected!');
+            closeInputChannel();
+        });
         socket.on('client_status', (data) => {
              if (data.status === 'connected') {
                 updateStatus('waiting', 'Client PC connected. Waiting for stream...');
+                openInputChannel();
             } else {
                 updateStatus('disconnected', 'Client PC disconnected.');
                 ctx.clearRect(0, 0, canvas.width, canvas.height); // Clear screen
+                closeInputChannel();
             }
         });
 
-        socket.on('initial_frame', (data) => {
-            console.log('Received initial frame.');
-            updateStatus('connected', 'Streaming...');
-            const img = new Image();
-            img.src = `data:image/jpeg;base64,${data.image}`;
-            img.onload = () => {
-                nativeWidth = canvas.width = img.width;
-                nativeHeight = canvas.height = img.height;
-                ctx.drawImage(img, 0, 0);
+        // Round-trip time to the broker, timed with an acked emit every 2 s and reported with
+        // the next one. The broker lowers encoder quality when the slowest viewer lags.
+        let lastRtt = null;
+        setInterval(() => {
+            if (!socket.connected) return;
+            const sent = performance.now();
+            socket.emit('rtt', lastRtt, () => { lastRtt = Math.round(performance.now() - sent); });
+        }, 2000);
+
+        // Optional unreliable input path: a WebRTC DataChannel straight to the client PC,
+        // signalled through the broker with rtc_signal and enabled only when RTC_ICE_SERVERS is
+        // set. Pointer moves use it once it is open, so a lost packet never holds up the newer
+        // positions queued behind it. The channel is ordered with no retransmits: lost moves are
+        // skipped, but an older one never lands after a newer one. Clicks and keys stay on the
+        // socket, which is reliable, and so do drags and the final position once the pointer
+        // rests. If the client PC never answers, everything goes over the socket.
+        const RTC_CONFIG = {{ rtc_config|tojson }};
+        let peer = null, inputChannel = null;
+        function closeInputChannel() {
+            if (peer) peer.close();
+            peer = inputChannel = null;
+        }
+        async function openInputChannel() {
+            closeInputChannel();
+            if (!RTC_CONFIG || !window.RTCPeerConnection) return;
+            const pc = peer = new RTCPeerConnection(RTC_CONFIG);
+            const channel = pc.createDataChannel('input', { ordered: true, maxRetransmits: 0 });
+            channel.binaryType = 'arraybuffer';
+            channel.onopen = () => { if (peer === pc) inputChannel = channel; };
+            channel.onclose = () => { if (inputChannel === channel) inputChannel = null; };
+            pc.onicecandidate = (e) => {
+                if (e.candidate) socket.emit('rtc_signal', { candidate: e.candidate.toJSON() });
             };
+            await pc.setLocalDescription(await pc.createOffer());
+            socket.emit('rtc_signal', { description: pc.localDescription.toJSON() });
+        }
+        socket.on('rtc_signal', async (data) => {
+            if (!peer) return;
+            try {
+                if (data.description) await peer.setRemoteDescription(data.description);
+                else if (data.candidate) await peer.addIceCandidate(data.candidate);
+            } catch (err) {
+                console.warn('WebRTC signalling failed:', err);
+            }
         });
 
-        socket.on('screen_update', (data) => {
-            // Use requestAnimationFrame for smoother rendering
-            requestAnimationFrame(() => {
-                data.updates.forEach(patch => {
-                    const img = new Image();
-                    img.src = `data:image/jpeg;base64,${patch.image}`;
-                    img.onload = () => {
-                        ctx.drawImage(img, patch.x, patch.y);
+        // Image decode pool. Tiles are spread round-robin over a few workers that decode with
+        // createImageBitmap and transfer the bitmap back, so a frame with many dirty tiles
+        // decodes in parallel and never queues behind input handling on this thread.
+        const DECODE_WORKER_SRC = `onmessage = async (e) => {
+            let bmp = null;
+            try { bmp = await createImageBitmap(e.data.blob); } catch (err) {}
+            postMessage({ id: e.data.id, bmp }, bmp ? [bmp] : []);
+        };`;
+        // A decode the pool can't finish (worker failed, crashed or hung past DECODE_TIMEOUT_MS)
+        // is redone on this thread, so every frame still settles and gets acked. A worker that
+        // errors is dropped from the pool; with none left, decoding stays on this thread.
+        const DECODE_TIMEOUT_MS = 2000;
+        let decoders = [];
+        const pendingDecodes = new Map(); // id -> { blob, resolve, worker, timer }
+        let nextDecodeId = 0;
+
+        function decodeOnMainThread(id) {
+            const pending = pendingDecodes.get(id);
+            if (!pending) return;
+            pendingDecodes.delete(id);
+            clearTimeout(pending.timer);
+            pending.resolve(createImageBitmap(pending.blob).catch(() => null));
+        }
+
+        function retireDecoder(worker) {
+            worker.terminate();
+            decoders = decoders.filter(w => w !== worker);
+            for (const [id, pending] of pendingDecodes) {
+                if (pending.worker === worker) decodeOnMainThread(id);
+            }
+        }
+
+        if (window.Worker) {
+            try {
+                const workerUrl = URL.createObjectURL(new Blob([DECODE_WORKER_SRC], { type: 'text/javascript' }));
+                const poolSize = Math.min(navigator.hardwareConcurrency || 2, 4);
+                for (let i = 0; i < poolSize; i++) {
+                    const worker = new Worker(workerUrl);
+                    worker.onmessage = (e) => {
+                        const pending = pendingDecodes.get(e.data.id);
+                        if (!pending) {
+                            // Already redone on this thread after a timeout.
+                            if (e.data.bmp) e.data.bmp.close();
+                            return;
+                        }
+                        // Browsers without createImageBitmap in workers come back empty; decode here instead.
+                        if (!e.data.bmp) return decodeOnMainThread(e.data.id);
+                        pendingDecodes.delete(e.data.id);
+                        clearTimeout(pending.timer);
+                        pending.resolve(e.data.bmp);
                     };
-                });
+                    worker.onerror = worker.onmessageerror = () => retireDecoder(worker);
+                    decoders.push(worker);
+                }
+            } catch (err) {
+                console.warn('Decode workers unavailable, decoding on the main thread:', err);
+            }
+        }
+
+        // Images arrive as raw encoded bytes (binary Socket.IO attachments, no base64), or as
+        // Blob slices of a packed update. Older client builds still send base64 strings.
+        // Resolves to a drawable bitmap, or null if it failed to decode; never rejects.
+        function loadImage(image) {
+            if (typeof image === 'string') {
+                // Fetching base64 as a data: URL decodes it natively; malformed input rejects here.
+                return fetch(`data:image/jpeg;base64,${image}`)
+                    .then(response => response.blob())
+                    .then(decodeImage, () => null);
+            }
+            return decodeImage(image instanceof Blob ? image : new Blob([image], { type: 'image/jpeg' }));
+        }
+
+        function decodeImage(blob) {
+            if (!decoders.length) return createImageBitmap(blob).catch(() => null);
+            return new Promise((resolve) => {
+                const id = nextDecodeId++;
+                const worker = decoders[id % decoders.length];
+                const timer = setTimeout(() => decodeOnMainThread(id), DECODE_TIMEOUT_MS);
+                pendingDecodes.set(id, { blob, resolve, worker, timer });
+                worker.postMessage({ id, blob });
             });
+        }
+
+        // Formats beyond JPEG that this browser decodes, found by decoding a 1x1 probe of each.
+        // Reported at registration so the client PC can send something more compact.
+        const FORMAT_PROBES = {
+            avif: 'AAAAIGZ0eXBhdmlmAAAAAGF2aWZtaWYxbWlhZk1BMUIAAADrbWV0YQAAAAAAAAAhaGRscgAAAAAAAAAAcGljdAAAAAAAAAAAAAAAAAAAAAAOcGl0bQAAAAAAAQAAAB5pbG9jAAAAAEQAAAEAAQAAAAEAAAETAAAAIAAAAChpaW5mAAAAAAABAAAAGmluZmUCAAAAAAEAAGF2MDFDb2xvcgAAAABqaXBycAAAAEtpcGNvAAAAFGlzcGUAAAAAAAAAAQAAAAEAAAAQcGl4aQAAAAADCAgIAAAADGF2MUOBAAwAAAAAE2NvbHJuY2x4AAEADQAGgAAAABdpcG1hAAAAAAAAAAEAAQQBAoMEAAAAKG1kYXQSAAoIGAAGiAhoNCAyEh7Hh4VZ3///4sAAAJA1jjx+rQ==',
+            webp: 'UklGRiIAAABXRUJQVlA4IBYAAAAwAQCdASoBAAEADsD+JaQAA3AAAAAA',
+        };
+        const formatsReady = Promise.all(Object.entries(FORMAT_PROBES).map(async ([format, probe]) => {
+            const bmp = await loadImage(probe);
+            if (!bmp) return null;
+            bmp.close();
+            return format;
+        })).then(formats => formats.filter(Boolean).concat('jpeg'));
+
+        // Every frame is acked once drawn; the server holds the next one back until then.
+        socket.on('initial_frame', async (data, ack) => {
+            console.log('Received initial frame.');
+            updateStatus('connected', 'Streaming...');
+            try {
+                const img = await loadImage(data.image);
+                if (img) {
+                    nativeWidth = canvas.width = img.width;
+                    nativeHeight = canvas.height = img.height;
+                    ctx.drawImage(img, 0, 0);
+                    img.close();
+                }
+            } catch (err) {
+                console.warn('Dropping malformed initial_frame:', err);
+            } finally {
+                // Always ack, even a bad frame: the server sends nothing more until we do.
+                if (ack) ack();
+            }
         });
 
+        // Packed tile update (layout documented in app.py): uint16 tile count, then
+        // uint16 x, uint16 y, uint32 length per tile, then the image bytes in the same order.
+        // The message is wrapped in one Blob and each tile is a slice of it, so the image
+        // bytes are copied once per update rather than once per tile.
+        function unpackTiles(buf) {
+            const view = new DataView(buf);
+            const blob = new Blob([buf]);
+            const count = view.getUint16(0, true);
+            const tiles = [];
+            let header = 2, offset = 2 + count * 8;
+            if (offset > buf.byteLength) throw new RangeError('tile table runs past the message');
+            for (let i = 0; i < count; i++, header += 8) {
+                const length = view.getUint32(header + 4, true);
+                if (offset + length > buf.byteLength) throw new RangeError('tile runs past the message');
+                tiles.push({
+                    x: view.getUint16(header, true),
+                    y: view.getUint16(header + 2, true),
+                    image: blob.slice(offset, offset + length, 'image/jpeg'),
+                });
+                offset += length;
+            }
+            return tiles;
+        }
+
+        socket.on('screen_update', async (data, ack) => {
+            let updates = [], imgs = [];
+            try {
+                updates = data instanceof ArrayBuffer ? unpackTiles(data) : data.updates;
+                imgs = await Promise.all(updates.map(patch => loadImage(patch.image)));
+            } catch (err) {
+                console.warn('Dropping malformed screen_update:', err);
+            } finally {
+                // Ack once decoded rather than once drawn: hidden tabs never run animation frames,
+                // and an ack held back by one would pace the stream for every viewer. A malformed
+                // update is acked too, or the server would never send this page another frame.
+                if (ack) ack();
+            }
+            const draw = () => {
+                imgs.forEach((img, i) => {
+                    if (!img) return;
+                    ctx.drawImage(img, updates[i].x, updates[i].y);
+                    img.close(); // release the decoded pixels now rather than at GC
+                });
+            };
+            // Use requestAnimationFrame for smoother rendering, but draw hidden tabs straight
+            // away so decoded bitmaps don't pile up waiting for a frame that never comes.
+            if (document.hidden) draw();
+            else requestAnimationFrame(draw);
+        });
+
+        // All input goes out as one binary 'in' event; see the IN_* layout in app.py.
+        const IN_MOUSE_MOVE = 1, IN_MOUSE_DOWN = 2, IN_MOUSE_UP = 3, IN_KEY_DOWN = 4, IN_KEY_UP = 5;
+        const textEncoder = new TextEncoder();
+
+        // A move sent over the unreliable channel may be lost; if it turns out to be the last
+        // one, it is resent over the socket once the pointer has rested this long.
+        const MOVE_SETTLE_MS = 100;
+        let moveSettleTimer = null;
         function sendMouseEvent(type, event) {
             if (!nativeWidth || !nativeHeight) return;
-            const rect = canvas.getBoundingClientRect();
+            const rect = canvasRect || (canvasRect = canvas.getBoundingClientRect());
             const scaleX = nativeWidth / rect.width;
             const scaleY = nativeHeight / rect.height;
             const x = (event.clientX - rect.left) * scaleX;
             const y = (event.clientY - rect.top) * scaleY;
-            
-            let button = 'left';
-            if (event.button === 2) button = 'right';
-            if (event.button === 1) button = 'middle';
 
-            socket.emit(type, { x, y, button });
+            const view = new DataView(new ArrayBuffer(10));
+            view.setUint8(0, type);
+            view.setFloat32(1, x, true);
+            view.setFloat32(5, y, true);
+            view.setUint8(9, event.button === 1 || event.button === 2 ? event.button : 0); // left/middle/right
+            // Moves with a button held stay on the socket so they can't reach the client PC
+            // ahead of the mousedown that started the drag.
+            if (type === IN_MOUSE_MOVE && inputChannel && !event.buttons) {
+                inputChannel.send(view.buffer);
+                clearTimeout(moveSettleTimer);
+                moveSettleTimer = setTimeout(() => socket.emit('in', view.buffer), MOVE_SETTLE_MS);
+                return;
+            }
+            clearTimeout(moveSettleTimer);
+            socket.emit('in', view.buffer);
+        }
+
+        function sendKeyEvent(type, event) {
+            const text = textEncoder.encode(`${event.key}\\0${event.code}`);
+            const packet = new Uint8Array(text.length + 1);
+            packet[0] = type;
+            packet.set(text, 1);
+            socket.emit('in', packet.buffer);
         }
 
-        canvas.addEventListener('mousemove', (e) => sendMouseEvent('mouse_move', e));
-        canvas.addEventListener('mousedown', (e) => sendMouseEvent('mouse_down', e));
-        canvas.addEventListener('mouseup', (e) => sendMouseEvent('mouse_up', e));
+        // Coalesce pointer moves to one emit per animation frame; only the latest position matters.
+        let pendingMove = null, moveScheduled = false;
+        function flushMove() {
+            moveScheduled = false;
+            if (pendingMove) sendMouseEvent(IN_MOUSE_MOVE, pendingMove);
+            pendingMove = null;
+        }
+        canvas.addEventListener('pointermove', (e) => {
+            pendingMove = e;
+            if (!moveScheduled) { moveScheduled = true; requestAnimationFrame(flushMove); }
+        });
+        canvas.addEventListener('mousedown', (e) => { pendingMove = null; sendMouseEvent(IN_MOUSE_DOWN, e); });
+        canvas.addEventListener('mouseup', (e) => { pendingMove = null; sendMouseEvent(IN_MOUSE_UP, e); });
         canvas.addEventListener('contextmenu', (e) => e.preventDefault());
 
         document.addEventListener('keydown', (e) => {
             e.preventDefault();
-            socket.emit('key_down', { key: e.key, code: e.code });
+            // The client PC auto-repeats a held key itself; forwarding the browser's repeats too
+            // would double the rate and flood the socket.
+            if (e.repeat) return;
+            sendKeyEvent(IN_KEY_DOWN, e);
         });
         document.addEventListener('keyup', (e) => {
             e.preventDefault();
-            socket.emit('key_up', { key: e.key, code: e.code });
+            sendKeyEvent(IN_KEY_UP, e);
         });
 
     </script>
@@ -145,25 +533,85 @@ CONTROL_HTML = """
 </html>
 """
 
+def precompress(html):
+    """Encode a rendered page once as Brotli, gzip and plain bytes, keyed by Content-Encoding.
+
+    The page's content hash is stored under 'etag' for conditional requests.
+    """
+    body = html.encode()
+    return {'br': brotli.compress(body, quality=11), 'gzip': gzip.compress(body, 9), None: body,
+            'etag': hashlib.sha256(body).hexdigest()[:16]}
+
+# Compile the templates once at import; render_template_string re-parses them on every request.
+# The pages are static, so they are also compressed here at maximum quality, once.
+_LOGIN_TMPL = app.jinja_env.from_string(LOGIN_HTML)
+_LOGIN_PAGE = precompress(_LOGIN_TMPL.render())
+# The failed-login page only ever shows one message, so it is pre-rendered too.
+_LOGIN_ERROR_PAGE = precompress(_LOGIN_TMPL.render(error="Invalid password"))
+with app.open_resource('static/socket.io.min.js') as f:
+    _SOCKETIO_JS_URL = f"/static/socket.io.min.js?v={hashlib.sha256(f.read()).hexdigest()[:12]}"
+_CONTROL_PAGE = precompress(app.jinja_env.from_string(CONTROL_HTML).render(
+    socketio_js=_SOCKETIO_JS_URL,
+    rtc_config={'iceServers': [{'urls': RTC_ICE_SERVERS}]} if RTC_ICE_SERVERS else None))
+
+def html_response(page):
+    """Serve a precompressed page in the best encoding the browser accepts."""
+    encoding = request.accept_encodings.best_match(('br', 'gzip'))
+    response = Response(page[encoding], mimetype='text/html')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # Whether a page is shown at all depends on the login cookie, so browsers must revalidate
+    # every time; an unchanged page then costs a bodyless 304. The ETag is weak because the
+    # same page goes out in several encodings.
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.set_etag(page['etag'], weak=True)
+    return response.make_conditional(request)
+
 # --- Flask Routes ---
+@app.after_request
+def cache_static(response):
+    # Versioned static URLs change whenever the file does, so browsers may keep them for a year
+    # without revalidating. Unversioned ones keep Flask's default of revalidating each time.
+    if request.endpoint == 'static' and 'v' in request.args:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    return response
+
+@app.before_request
+def load_auth():
+    # Flask has already loaded the session by now; static assets just skip the login lookup.
+    if request.endpoint != 'static':
+        g._authed = bool(session.get('authenticated'))
+
+def login_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not g._authed:
+            return redirect('/')
+        return view(*args, **kwargs)
+    return wrapper
+
 @app.route('/')
 def index():
-    if session.get('authenticated'):
+    if g._authed:
         return redirect('/control')
-    return render_template_string(LOGIN_HTML)
+    return html_response(_LOGIN_PAGE)
 
 @app.route('/', methods=['POST'])
 def login():
     if request.form.get('password') == REMOTE_PASSWORD:
         session['authenticated'] = True
         return redirect('/control')
-    return render_template_string(LOGIN_HTML, error="Invalid password")
+    return html_response(_LOGIN_ERROR_PAGE)
 
 @app.route('/control')
+@login_required
 def control():
-    if not session.get('authenticated'):
-        return redirect('/')
-    return render_template_string(CONTROL_HTML)
+    return html_response(_CONTROL_PAGE)
 
 @app.route('/logout')
 def logout():
@@ -173,83 +621,339 @@ def logout():
 # --- SocketIO Event Handlers (The Broker Logic) ---
 @socketio.on('connect')
 def handle_connect():
-    logger.info(f"A user or client connected: {request.sid}")
+    sid = request.sid
+    logger.debug("A user or client connected: %s", sid)
+    if session.get('authenticated'):
+        authenticated_sids.add(sid)
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    global active_client_sid
+    global active_client_sid, client_status_payload, last_keyframe, updates_since_keyframe, frames_held
     sid = request.sid
-    logger.info(f"User or client disconnected: {sid}")
+    logger.debug("User or client disconnected: %s", sid)
+    authenticated_sids.discard(sid)
     if sid == active_client_sid:
         active_client_sid = None
+        client_status_payload = STATUS_DISCONNECTED
+        last_keyframe = None
+        frames_held = False
+        reset_frame_delivery()
         logger.warning("Controlled client PC has disconnected.")
         # Notify all controllers
-        for controller_sid in active_controller_sids:
-             socketio.emit('client_status', {'status': 'disconnected'}, room=controller_sid)
-    elif sid in active_controller_sids:
-        active_controller_sids.discard(sid)
-        logger.info(f"Controller {sid} disconnected.")
+        socketio.emit('client_status', client_status_payload, room=CONTROLLERS_ROOM, ignore_queue=True)
+    elif active_controllers.pop(sid, None) is not None:
+        logger.info("Controller %s disconnected.", sid)
+        if not active_controllers and active_client_sid:
+            # Nobody is watching: let the client PC stop capturing and encoding.
+            socketio.emit('stop_capture', room=active_client_sid, ignore_queue=True)
+            # Changes made while capture is off never arrive, so the cache can't be replayed.
+            updates_since_keyframe = None
+        update_frame_credit()
+        update_stream_format()
+        update_stream_quality()
 
 @socketio.on('register_client')
 def handle_register_client(data):
-    global active_client_sid
+    global active_client_sid, client_status_payload, keyframe_requested_at, last_keyframe, last_update_hash
+    global frames_held
+    sid = request.sid
     if data.get('secret') == CLIENT_SECRET_KEY:
-        active_client_sid = request.sid
-        logger.info(f"Client PC registered successfully with SID: {active_client_sid}")
+        active_client_sid = sid
+        frames_held = False
+        client_status_payload = STATUS_CONNECTED
+        keyframe_requested_at = None
+        last_keyframe = None
+        last_update_hash = None
+        reset_frame_delivery()
+        logger.info("Client PC registered successfully with SID: %s", active_client_sid)
         # Notify all controllers that the client is now connected
-        for controller_sid in active_controller_sids:
-             socketio.emit('client_status', {'status': 'connected'}, room=controller_sid)
-             if controller_sid in active_controller_sids: # double check
-                socketio.emit('request_initial_frame', room=active_client_sid)
+        socketio.emit('client_status', client_status_payload, room=CONTROLLERS_ROOM, ignore_queue=True)
+        socketio.emit('capabilities_update', {'format': stream_format}, room=active_client_sid, ignore_queue=True)
+        socketio.emit('set_quality', {'q': stream_quality}, room=active_client_sid, ignore_queue=True)
+        # One keyframe reaches every controller, so ask for it once rather than once per controller.
+        if active_controllers:
+            socketio.emit('start_capture', room=active_client_sid, ignore_queue=True)
+            request_keyframe()
+        else:
+            socketio.emit('stop_capture', room=active_client_sid, ignore_queue=True)
     else:
-        logger.warning(f"Failed client registration from {request.sid}. Disconnecting.")
-        socketio.disconnect(request.sid)
+        logger.warning("Failed client registration from %s. Disconnecting.", sid)
+        socketio.disconnect(sid)
 
 @socketio.on('register_controller')
-def handle_register_controller():
-    if not session.get('authenticated'):
-        logger.warning(f"Unauthenticated controller registration attempt from {request.sid}. Disconnecting.")
-        return
-    
+def handle_register_controller(data=None):
     controller_sid = request.sid
-    active_controller_sids.add(controller_sid)
-    logger.info(f"Controller registered: {controller_sid}")
+    if controller_sid not in authenticated_sids:
+        logger.warning("Unauthenticated controller registration attempt from %s. Disconnecting.", controller_sid)
+        return
+
+    if controller_sid not in active_controllers:
+        if not active_controllers and active_client_sid:
+            socketio.emit('start_capture', room=active_client_sid, ignore_queue=True)
+        formats = data.get('formats') if isinstance(data, dict) else None
+        active_controllers[controller_sid] = Controller(controller_sid, formats)
+        join_room(CONTROLLERS_ROOM)
+        update_stream_format()
+    logger.info("Controller registered: %s", controller_sid)
     
+    socketio.emit('client_status', client_status_payload, room=controller_sid, ignore_queue=True)
     if active_client_sid:
-        logger.info(f"Notifying new controller {controller_sid} that client is online.")
-        socketio.emit('client_status', {'status': 'connected'}, room=controller_sid)
-        logger.info(f"Requesting new initial frame for controller {controller_sid}.")
-        socketio.emit('request_initial_frame', room=active_client_sid)
+        if last_keyframe is not None:
+            controller = active_controllers[controller_sid]
+            queue_frame(controller, 'initial_frame', last_keyframe)
+            if updates_since_keyframe is not None and time.monotonic() - last_keyframe_at < KEYFRAME_CACHE_TTL:
+                for update in updates_since_keyframe:
+                    queue_frame(controller, 'screen_update', update)
+                update_frame_credit()
+                logger.debug("Sent cached keyframe and %s updates to controller %s.", len(updates_since_keyframe), controller_sid)
+                return
+        logger.debug("Requesting new initial frame for controller %s.", controller_sid)
+        request_keyframe()
     else:
-        logger.info(f"Notifying controller {controller_sid} to wait for client.")
-        socketio.emit('client_status', {'status': 'disconnected'}, room=controller_sid)
+        logger.debug("Notifying controller %s to wait for client.", controller_sid)
 
 # --- Passthrough Events ---
-# These events simply relay data from the controller to the client, or vice-versa
+# These events simply relay data from the controller to the client, or vice-versa.
+# Frame payloads carry raw encoded image bytes, which python-socketio forwards as binary
+# attachments without any JSON/base64 round-trip.
+
+# A screen_update may be one packed binary message holding every dirty tile of a frame
+# (the older {'updates': [{'x', 'y', 'image'}, ...]} dict is still accepted):
+#   struct '<H' tile count, then '<HHI' (x, y, image length) per tile, then the images in order.
+
+# Controller input travels as a single binary 'in' event, forwarded byte-for-byte.
+# The first byte is the event type:
+#   mouse move/down/up: struct '<BffB' (type, x, y, button: 0=left 1=middle 2=right)
+#   key down/up:        type byte followed by UTF-8 "key\0code"
+IN_MOUSE_MOVE, IN_MOUSE_DOWN, IN_MOUSE_UP, IN_KEY_DOWN, IN_KEY_UP = range(1, 6)
+
+def update_stream_format():
+    """Switch the client PC to the most compact format every controller can decode."""
+    global stream_format, last_keyframe, keyframe_requested_at
+    if not active_controllers:
+        return  # keep the current format until someone is watching again
+    controllers = active_controllers.values()
+    fmt = next((f for f in STREAM_FORMATS if all(f in c.formats for c in controllers)), 'jpeg')
+    if fmt == stream_format:
+        return
+    logger.info("Switching stream format from %s to %s.", stream_format, fmt)
+    stream_format = fmt
+    # The cached keyframe is in the old format, which a joining controller may not decode.
+    # So may the answer to any keyframe request still outstanding, so ask again rather than
+    # letting that request suppress a fresh one in the new format.
+    last_keyframe = None
+    keyframe_requested_at = None
+    if active_client_sid:
+        socketio.emit('capabilities_update', {'format': fmt}, room=active_client_sid, ignore_queue=True)
+        request_keyframe()
+
+def update_stream_quality():
+    """Tell the client PC which quality tier the slowest controller's RTT calls for."""
+    global stream_quality
+    if not active_controllers:
+        return
+    worst = max(c.rtt for c in active_controllers.values())
+    lower = next((q for limit, q in QUALITY_TIERS if worst < limit), MIN_QUALITY)
+    higher = next((q for limit, q in QUALITY_TIERS if worst < limit - QUALITY_HYSTERESIS_MS), MIN_QUALITY)
+    if lower < stream_quality:
+        quality = lower
+    elif higher > stream_quality:
+        quality = higher
+    else:
+        return
+    logger.info("Worst controller RTT %.0f ms; switching quality from %s to %s.", worst, stream_quality, quality)
+    stream_quality = quality
+    if active_client_sid:
+        socketio.emit('set_quality', {'q': quality}, room=active_client_sid, ignore_queue=True)
+
+def request_keyframe():
+    """Ask the client PC for a keyframe unless a request is already outstanding."""
+    global keyframe_requested_at
+    now = time.monotonic()
+    if keyframe_requested_at is not None and now - keyframe_requested_at < KEYFRAME_REQUEST_TIMEOUT:
+        return
+    keyframe_requested_at = now
+    socketio.emit('request_initial_frame', room=active_client_sid, ignore_queue=True)
+
+def relay_frame(event_name, data):
+    """Shared handler for every client -> controller frame event."""
+    global keyframe_requested_at, last_keyframe, last_keyframe_at, last_update_hash, updates_since_keyframe
+    if request.sid != active_client_sid:
+        return
+    if event_name == 'initial_frame':
+        keyframe_requested_at = None
+        last_keyframe = data
+        last_keyframe_at = time.monotonic()
+        last_update_hash = None
+        updates_since_keyframe = []
+    else:
+        if isinstance(data, bytes):
+            digest = hash(data)
+            if digest == last_update_hash:
+                return
+            last_update_hash = digest
+        if updates_since_keyframe is not None:
+            if len(updates_since_keyframe) < KEYFRAME_REPLAY_LIMIT:
+                updates_since_keyframe.append(data)
+            else:
+                updates_since_keyframe = None
+    for controller in active_controllers.values():
+        queue_frame(controller, event_name, data)
+    update_frame_credit()
+
+def queue_frame(controller, event_name, data):
+    backlog = controller.frame_backlog
+    if event_name == 'initial_frame':
+        # A keyframe repaints everything, so nothing queued before it matters.
+        backlog.clear()
+        controller.stale = False
+    elif controller.stale:
+        return
+    elif len(backlog) >= MAX_FRAME_BACKLOG:
+        logger.warning("Controller %s fell behind; dropping %s queued frames.", controller.sid, len(backlog))
+        backlog.clear()
+        controller.stale = True
+        return
+    backlog.append((event_name, data))
+    if not controller.frame_in_flight:
+        send_next_frame(controller)
+
+def send_next_frame(controller):
+    backlog = controller.frame_backlog
+    if not backlog:
+        controller.frame_in_flight = False
+        if controller.stale and active_client_sid:
+            request_keyframe()
+        return
+    global frame_watchdog_running
+    event_name, data = backlog.popleft()
+    controller.frame_in_flight = True
+    controller.frame_sent_at = time.monotonic()
+    controller.frame_seq += 1
+    # Emitted on the server directly: SocketIO.emit would run the ack in the context of the
+    # sending sid (usually the client PC), and drop it if that sid has gone in the meantime.
+    socketio.server.emit(event_name, data, room=controller.sid, ignore_queue=True,
+                         callback=partial(frame_acked, controller, controller.frame_seq))
+    if not frame_watchdog_running:
+        frame_watchdog_running = True
+        socketio.start_background_task(watch_frames)
+    if frames_held:
+        update_frame_credit()
+
+def frame_acked(controller, seq, *args):
+    if seq == controller.frame_seq and controller.frame_in_flight:
+        took = time.monotonic() - controller.frame_sent_at
+        controller.ack_time = took if not controller.ack_time else 0.8 * controller.ack_time + 0.2 * took
+        send_next_frame(controller)
 
-def forward_to_client(event_name):
-    @socketio.on(event_name)
-    def handler(data):
-        if request.sid in active_controller_sids and active_client_sid:
-            socketio.emit(event_name, data, room=active_client_sid)
+def ack_deadline(controller):
+    """How long this controller's in-flight frame may go unacked before it stops pacing the stream."""
+    # Kept under FRAME_ACK_TIMEOUT so a frame is never written off while it still holds the stream.
+    return min(max(FRAME_ACK_DEADLINE, FRAME_ACK_DEADLINE_FACTOR * controller.ack_time), FRAME_ACK_TIMEOUT / 2)
 
-def forward_to_controllers(event_name):
-    @socketio.on(event_name)
-    def handler(data):
-        if request.sid == active_client_sid:
-            for controller_sid in active_controller_sids:
-                socketio.emit(event_name, data, room=controller_sid)
+def reset_frame_delivery():
+    """Forget every controller's queued and in-flight frames when the client PC changes."""
+    for controller in active_controllers.values():
+        controller.frame_backlog.clear()
+        controller.frame_in_flight = False
+        controller.frame_seq += 1
+        controller.stale = False
+
+def watch_frames():
+    """Write off frames whose ack never came, while any controller is registered.
+
+    Also re-checks a hold each tick: once the producer is paused, nothing else would notice
+    that the controller holding it has gone overdue.
+    """
+    global frame_watchdog_running
+    while active_controllers:
+        socketio.sleep(1.0)
+        if frames_held:
+            update_frame_credit()
+        now = time.monotonic()
+        for controller in list(active_controllers.values()):
+            if controller.frame_in_flight and now - controller.frame_sent_at > FRAME_ACK_TIMEOUT:
+                logger.warning("Controller %s never acked a frame; resyncing it.", controller.sid)
+                controller.frame_backlog.clear()
+                controller.frame_in_flight = False
+                controller.frame_seq += 1
+                controller.stale = True
+                if active_client_sid:
+                    request_keyframe()
+    frame_watchdog_running = False
+
+def update_frame_credit():
+    """Tell the client PC to hold or resume frames when the slowest controller crosses FRAME_CREDIT."""
+    global frames_held
+    now = time.monotonic()
+    behind = any(len(c.frame_backlog) >= FRAME_CREDIT and now - c.frame_sent_at < ack_deadline(c)
+                 for c in active_controllers.values())
+    if behind != frames_held and active_client_sid:
+        frames_held = behind
+        socketio.emit('hold_frames' if behind else 'request_frame', room=active_client_sid, ignore_queue=True)
 
 # Controller -> Client
-forward_to_client('mouse_move')
-forward_to_client('mouse_down')
-forward_to_client('mouse_up')
-forward_to_client('key_down')
-forward_to_client('key_up')
+@socketio.on('in')
+def handle_input(data):
+    # Resolve sender and target once; everything below works on these locals.
+    client_sid = active_client_sid
+    controller = active_controllers.get(request.sid)
+    if controller is None or client_sid is None or not isinstance(data, bytes) or not data:
+        return
+    kind = data[0]
+    if kind != IN_MOUSE_MOVE:
+        if kind == IN_MOUSE_DOWN or kind == IN_MOUSE_UP:
+            # Clicks carry their own position, so a held-back move would only arrive stale.
+            controller.pending_move = None
+        socketio.emit('in', data, room=client_sid, ignore_queue=True)
+        return
+    now = time.monotonic()
+    wait = controller.last_move_ts + MOUSE_MOVE_INTERVAL - now
+    if wait <= 0:
+        controller.last_move_ts = now
+        socketio.emit('in', data, room=client_sid, ignore_queue=True)
+        return
+    if controller.pending_move is None:
+        socketio.start_background_task(flush_mouse_move, controller, wait)
+    controller.pending_move = data
+
+def flush_mouse_move(controller, delay):
+    socketio.sleep(delay)
+    data, controller.pending_move = controller.pending_move, None
+    client_sid = active_client_sid
+    if data is not None and client_sid is not None and controller.sid in active_controllers:
+        controller.last_move_ts = time.monotonic()
+        socketio.emit('in', data, room=client_sid, ignore_queue=True)
+
+# Controllers time an acked 'rtt' emit every couple of seconds and report the result with
+# the next one. Returning acks it.
+@socketio.on('rtt')
+def handle_rtt(rtt_ms):
+    controller = active_controllers.get(request.sid)
+    if controller is None or not isinstance(rtt_ms, (int, float)):
+        return
+    controller.rtt = rtt_ms
+    update_stream_quality()
+
+# WebRTC signalling for the controllers' optional input DataChannel. The broker only relays:
+# a controller's offer/candidates go to the client PC tagged with the controller's sid, and
+# the client PC's answer/candidates come back with that sid to pick the controller.
+@socketio.on('rtc_signal')
+def handle_rtc_signal(data):
+    sid = request.sid
+    client_sid = active_client_sid
+    if client_sid is None or not isinstance(data, dict):
+        return
+    if sid in active_controllers:
+        socketio.emit('rtc_signal', dict(data, sid=sid), room=client_sid, ignore_queue=True)
+    elif sid == client_sid:
+        target = data.pop('sid', None)
+        if target in active_controllers:
+            socketio.emit('rtc_signal', data, room=target, ignore_queue=True)
 
 # Client -> Controller(s)
-forward_to_controllers('initial_frame')
-forward_to_controllers('screen_update')
+for frame_event in ('initial_frame', 'screen_update'):
+    socketio.on_event(frame_event, partial(relay_frame, frame_event))
 
 if __name__ == '__main__':
     logger.info("Starting server...")